@@ -1,6 +1,25 @@
 #!/usr/bin/env python3
-import requests
+import argparse
+import io
+import json
 import math
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from functools import lru_cache
+from pathlib import Path
+from statistics import median
+
+import numpy as np
+import orjson
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional; NumPy is used instead
+    njit = None
+
+from ods_client import HTTP_TIMEOUT, SESSION, odre
 
 # -------------------------
 # Config
@@ -10,6 +29,7 @@ INSEE_ANTONY = "92002"
 
 REGISTRE_DATASET = "registre-national-installation-production-stockage-electricite-agrege"
 
+@lru_cache(maxsize=None)
 def registre_dataset(year: int | None = None) -> str:
     """
     Returns the data set for installed capacity at the end of the given year,
@@ -17,8 +37,6 @@ def registre_dataset(year: int | None = None) -> str:
     """
     return REGISTRE_DATASET + (f"-3112{year % 100}" if year else "")
 
-ODRE_BASE = "https://odre.opendatasoft.com/api/explore/v2.1/catalog/datasets"
-
 # Fields in ODRE register
 REGISTER_COMMUNE_FIELD = "codeinseecommune"
 REGISTER_GEN_CODE_FIELD = "codefiliere"
@@ -27,6 +45,16 @@ REGISTER_CAP_FIELD = "puismaxrac"
 REGISTER_ENERGY_FIELD_OLD = "energieannuelleinjectee"  # valid before 2020
 REGISTER_ENERGY_FIELD = "energieannuelleglissanteinjectee"  # valid from 2020 onward
 
+# Query for Antony's photovoltaic capacity and energy; only the energy
+# field and the dataset depend on the year.
+ANTONY_PV_WHERE = (
+    f"{REGISTER_COMMUNE_FIELD}='{INSEE_ANTONY}'"
+    f" AND {REGISTER_GEN_CODE_FIELD} like 'SOLAI'"
+    f" AND {REGISTER_TECH_CODE_FIELD} like 'PHOTV'"
+)
+ANTONY_PV_SELECT_OLD = f"sum({REGISTER_CAP_FIELD}) as cap_kw, sum({REGISTER_ENERGY_FIELD_OLD}) as e_kwh"
+ANTONY_PV_SELECT = f"sum({REGISTER_CAP_FIELD}) as cap_kw, sum({REGISTER_ENERGY_FIELD}) as e_kwh"
+
 # Irradiance config (same as widget)
 OPEN_METEO_BASE = "https://satellite-api.open-meteo.com/v1/archive"
 ANT_LAT = 48.75
@@ -38,15 +66,37 @@ PANEL_AZIMUTH_DEG = 0
 START_YEAR = 2017
 END_YEAR = 2024
 
+# On-disk cache for data of past (complete) years, which no longer changes.
+CACHE_DIR = Path(__file__).resolve().parent / ".cache"
+
+# Number of concurrent API requests
+MAX_WORKERS = 8
+
 
 # -------------------------
 # Helpers
 # -------------------------
 
 def fetch_json(url: str, params: dict | None = None) -> dict:
-    r = requests.get(url, params=params, timeout=30)
+    r = SESSION.get(url, params=params, timeout=HTTP_TIMEOUT)
     r.raise_for_status()
-    return r.json()
+    return orjson.loads(r.content)
+
+def is_cacheable(year: int) -> bool:
+    """
+    Only data for years that are over is written to the disk cache.
+    """
+    return year < date.today().year
+
+def write_cache(path: Path, data: bytes) -> None:
+    """
+    Write a disk cache file atomically (temporary file, then rename), so an
+    interrupted run cannot leave a truncated file behind.
+    """
+    CACHE_DIR.mkdir(exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix=".tmp", delete=False) as f:
+        f.write(data)
+    Path(f.name).replace(path)
 
 def get_antony_capacity_and_energy_year(year: int) -> tuple[float, float]:
     """
@@ -54,31 +104,30 @@ def get_antony_capacity_and_energy_year(year: int) -> tuple[float, float]:
       - Capacity: sum(puismaxrac) in kW
       - Energy:   sum(energieannuelleglissanteinjectee) in kWh (Antony)
     """
+    path = CACHE_DIR / f"odre_{INSEE_ANTONY}_{year}.json"
+    if path.exists():
+        cap_kw, e_kwh = json.loads(path.read_text())
+        return cap_kw, e_kwh
+
     dataset = registre_dataset(year)
-    url = f"{ODRE_BASE}/{dataset}/records"
 
     params = {
-        "where": (
-            f"{REGISTER_COMMUNE_FIELD}='{INSEE_ANTONY}'"
-            f" AND {REGISTER_GEN_CODE_FIELD} like 'SOLAI'"
-            f" AND {REGISTER_TECH_CODE_FIELD} like 'PHOTV'"
-        ),
-        "select": (
-            f"sum({REGISTER_CAP_FIELD}) as cap_kw,"
-            f" sum({REGISTER_ENERGY_FIELD_OLD if year < 2020 else REGISTER_ENERGY_FIELD}) as e_kwh"
-        ),
+        "where": ANTONY_PV_WHERE,
+        "select": ANTONY_PV_SELECT_OLD if year < 2020 else ANTONY_PV_SELECT,
         "group_by": REGISTER_COMMUNE_FIELD,
-        "limit": 5,
+        "limit": 1,
     }
 
-    data = fetch_json(url, params)
-    results = data.get("results", [])
+    results = odre.records(dataset, **params)
     if not results:
         raise RuntimeError(f"No ODRE records for Antony in year {year} (dataset {dataset})")
 
     row = results[0]
     cap_kw = float(row["cap_kw"]) if row["cap_kw"] is not None else 0.0
     e_kwh = float(row["e_kwh"]) if row["e_kwh"] is not None else 0.0
+
+    if is_cacheable(year):
+        write_cache(path, json.dumps([cap_kw, e_kwh]).encode())
     return cap_kw, e_kwh
 
 def get_annual_irradiance_series(year: int) -> list[float]:
@@ -92,7 +141,8 @@ def get_annual_irradiance_series(year: int) -> list[float]:
         "hourly": "global_tilted_irradiance",
         "tilt": PANEL_TILT_DEG,
         "azimuth": PANEL_AZIMUTH_DEG,
-        "timeformat": "iso8601",
+        # Timestamps are not used: unix time is cheaper to send and parse.
+        "timeformat": "unixtime",
         "timezone": "Europe/Paris",
         "time_resolution": "native",
         "start_date": f"{year}-01-01",
@@ -106,108 +156,171 @@ def get_annual_irradiance_series(year: int) -> list[float]:
         raise RuntimeError(f"No irradiance data for year {year}")
     return gti
 
+def get_annual_irradiance_array(year: int) -> np.ndarray:
+    """
+    Hourly global_tilted_irradiance for the year as a float32 array (W/m²),
+    with missing hours set to 0. float32 is ample for W/m² and halves
+    memory traffic. Past years are cached on disk, but only when the series
+    is complete: the archive may still be missing the last hours of a year
+    that has just ended.
+    """
+    path = CACHE_DIR / (
+        f"gti_{year}_{ANT_LAT}_{ANT_LON}_{PANEL_TILT_DEG}_{PANEL_AZIMUTH_DEG}.npy"
+    )
+    if path.exists():
+        gti = np.load(path)
+    else:
+        gti = np.asarray(get_annual_irradiance_series(year), dtype=np.float32)
+        complete = len(gti) in (8760, 8784) and not np.isnan(gti).any()
+        gti = np.nan_to_num(gti)
+        if complete and is_cacheable(year):
+            buf = io.BytesIO()
+            np.save(buf, gti)
+            write_cache(path, buf.getvalue())
+    return gti
+
+def _hour_scale(n: int) -> float:
+    """
+    1 / (n - 1): the fraction of the year elapsed per hour, such that hour i
+    is at tau = i * _hour_scale(n), from 0 to 1.
+    """
+    return 1.0 / (n - 1) if n > 1 else 0.0
+
+@lru_cache(maxsize=None)
+def _hours(n: int) -> np.ndarray:
+    """
+    Hour indices 0 .. n-1. Only depends on the length of the year (8760 or
+    8784 hours), so it is shared between years.
+    """
+    hours = np.arange(n, dtype=np.float32)
+    hours.flags.writeable = False
+    return hours
+
+@lru_cache(maxsize=None)
+def _prep(year: int) -> np.ndarray:
+    """
+    Hourly energy per kWp (kWh/kWp), shared by the irradiance sum and both
+    K computations, built once per year.
+    """
+    # Hourly step; G in W/m². 1 kWp ~ 1000 W/m².
+    # So energy contribution per kWp for that hour = G/1000 kWh.
+    gti = get_annual_irradiance_array(year) / 1000.0
+    gti.flags.writeable = False
+    return gti
+
 def get_annual_irradiance_kwh_per_kwp(year: int) -> float:
     """
     Call Open-Meteo to get hourly global_tilted_irradiance for the entire year.
     Convert to annual "H" in kWh per kWp (sum(G/1000) over hours).
     """
-    gti = get_annual_irradiance_series(year)
-
-    total_kwh_per_kwp = 0.0
-    for v in gti:
-        if v is None:
-            continue
-        # Hourly step; G in W/m². 1 kWp ~ 1000 W/m².
-        # So energy contribution per kWp for that hour = G/1000 kWh.
-        total_kwh_per_kwp += v / 1000.0
-
-    return total_kwh_per_kwp
+    return float(np.sum(_prep(year)))
 
 # -------------------------
 # Main calibration logic
 # -------------------------
 
-def compute_K_exponential(
+if njit is not None:
+    @njit(fastmath=True, cache=True)
+    def _denoms(gti: np.ndarray, C_prev_kw: float, C_curr_kw: float, k: float) -> tuple[float, float]:
+        """
+        sum(C(tau) * gti) for exponential and linear C(tau), in a single
+        fused loop that reads each gti[i] once.
+        """
+        n = len(gti)
+        inv = 1.0 / (n - 1) if n > 1 else 0.0
+        scale = k * inv
+        slope = (C_curr_kw - C_prev_kw) * inv
+        s_exp = 0.0
+        s_lin = 0.0
+        for i in range(n):
+            s_exp += math.exp(scale * i) * gti[i]
+            s_lin += (C_prev_kw + slope * i) * gti[i]
+        return C_prev_kw * s_exp, s_lin
+else:
+    def _denoms(gti: np.ndarray, C_prev_kw: float, C_curr_kw: float, k: float) -> tuple[float, float]:
+        """
+        sum(C(tau) * gti) for exponential and linear C(tau).
+        """
+        n = len(gti)
+        hours = _hours(n)
+        C_exp = C_prev_kw * np.exp((k * _hour_scale(n)) * hours)
+        C_lin = C_prev_kw + ((C_curr_kw - C_prev_kw) * _hour_scale(n)) * hours
+        return float(np.dot(C_exp, gti)), float(np.dot(C_lin, gti))
+
+def exp_capacity_avg_kw(C_prev_kw: float, C_curr_kw: float) -> float:
+    """
+    Time-averaged capacity over a year of exponential increase from
+    C_prev_kw to C_curr_kw: C_prev * (exp(k) - 1) / k.
+    """
+    k = math.log(C_curr_kw / C_prev_kw)
+    if abs(k) < 1e-12:
+        return C_prev_kw
+    return (C_curr_kw - C_prev_kw) / k
+
+def compute_K_both(
     year: int,
     C_prev_kw: float,
     C_curr_kw: float,
     E_kwh: float,
-) -> float:
+) -> tuple[float, float]:
     """
     Compute calibration factor K for a given year, assuming
-    exponential capacity increase from C_prev_kw to C_curr_kw
-    across that year, using hourly irradiance from Open-Meteo.
+    exponential, then linear, capacity increase from C_prev_kw to
+    C_curr_kw across that year, using hourly irradiance from Open-Meteo.
+    Both are computed in one pass over the irradiance.
     """
     if C_prev_kw <= 0 or C_curr_kw <= 0:
         raise ValueError(f"Non-positive capacity for year {year}: C_prev={C_prev_kw}, C_curr={C_curr_kw}")
     if E_kwh <= 0:
         raise ValueError(f"Non-positive energy E_kwh={E_kwh} for year {year}")
 
-    gti = get_annual_irradiance_series(year)
-    N = len(gti)
+    gti = _prep(year)
 
     # exponential growth rate
     k = math.log(C_curr_kw / C_prev_kw)
 
-    denom = 0.0
-    for i, v in enumerate(gti):
-        if v is None:
-            continue
-        # fraction of the year elapsed
-        tau = i / (N - 1) if N > 1 else 0.0
-        C_t = C_prev_kw * math.exp(k * tau)
-        # per hour: convert W/m² to kWh/kWp by dividing by 1000
-        denom += C_t * (v / 1000.0)
+    denom_exp, denom_lin = _denoms(gti, C_prev_kw, C_curr_kw, k)
 
-    if denom <= 0:
+    if denom_exp <= 0 or denom_lin <= 0:
         raise RuntimeError(f"Computed zero or negative denom for year {year}")
 
-    K = E_kwh / denom
-    return K
-
-def compute_K_linear(
-    year: int,
-    C_prev_kw: float,
-    C_curr_kw: float,
-    E_kwh: float,
-) -> float:
-    gti = get_annual_irradiance_series(year)
-    N = len(gti)
-    if N == 0:
-        raise RuntimeError(f"No irradiance data for year {year}")
-    denom = 0.0
-    for i, v in enumerate(gti):
-        if v is None:
-            continue
-        tau = i / (N - 1) if N > 1 else 0.0
-        C_t = C_prev_kw + (C_curr_kw - C_prev_kw) * tau
-        denom += C_t * (v / 1000.0)
-    if denom <= 0:
-        raise RuntimeError(f"Denom=0 for year {year}")
-    return E_kwh / denom
+    return E_kwh / denom_exp, E_kwh / denom_lin
 
 def main():
+    parser = argparse.ArgumentParser(description="Calibrate K for Antony's PV production.")
+    parser.add_argument("--refresh", action="store_true", help="discard cached data and fetch it again")
+    args = parser.parse_args()
+
+    if args.refresh:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
     # 1) Get C_year and E_year for years [START_YEAR .. END_YEAR]
     years = list(range(START_YEAR, END_YEAR + 1))
     cap = {}
     energy = {}
 
-    print("Fetching ODRE capacity and energy for Antony...")
-    for y in years:
-        c_kw, e_kwh = get_antony_capacity_and_energy_year(y)
-        cap[y] = c_kw
-        energy[y] = e_kwh
-        print(f"  {y}: C={c_kw:.1f} kW, E={e_kwh/1000:.1f} MWh")
+    irr_years = list(range(START_YEAR + 1, END_YEAR + 1))
+
+    # All requests are independent: issue them concurrently.
+    with ThreadPoolExecutor(MAX_WORKERS) as ex:
+        odre_results = ex.map(get_antony_capacity_and_energy_year, years)
+        irr_results = ex.map(get_annual_irradiance_kwh_per_kwp, irr_years)
+
+        print("Fetching ODRE capacity and energy for Antony...")
+        for y, (c_kw, e_kwh) in zip(years, odre_results):
+            cap[y] = c_kw
+            energy[y] = e_kwh
+            print(f"  {y}: C={c_kw:.1f} kW, E={e_kwh/1000:.1f} MWh")
 
-    print("\nFetching annual irradiance from Open-Meteo...")
-    H = {}
-    for y in range(START_YEAR + 1, END_YEAR + 1):
-        H[y] = get_annual_irradiance_kwh_per_kwp(y)
-        print(f"  {y}: H={H[y]:.1f} kWh/kWp")
+        print("\nFetching annual irradiance from Open-Meteo...")
+        H = {}
+        for y, h in zip(irr_years, irr_results):
+            H[y] = h
+            print(f"  {y}: H={H[y]:.1f} kWh/kWp")
 
     print("\n=== Annual calibration K (exponential capacity) ===")
-    print("Year | C_prev (kW) | C_curr (kW) | E (MWh) |   K_exp  |   K_lin")
-    print("-----+-------------+------------+---------+---------+--------")
+    print("Year | C_prev (kW) | C_curr (kW) | E (MWh) |   K_exp  |   K_lin |  K_flat")
+    print("-----+-------------+------------+---------+---------+---------+--------")
 
     K_exp_list = []
     K_lin_list = []
@@ -221,24 +334,25 @@ def main():
             print(f"{y:4d} | (missing data)")
             continue
 
-        K_exp = compute_K_exponential(y, C_prev, C_curr, E_y)
-        K_lin = compute_K_linear(y, C_prev, C_curr, E_y)
+        K_exp, K_lin = compute_K_both(y, C_prev, C_curr, E_y)
+        # Sanity check: K_exp if irradiance were spread evenly over the year
+        K_flat = E_y / (exp_capacity_avg_kw(C_prev, C_curr) * H[y])
 
         K_exp_list.append(K_exp)
         K_lin_list.append(K_lin)
 
-        print(f"{y:4d} | {C_prev:11.1f} | {C_curr:10.1f} | {E_y/1000:7.1f} | {K_exp:7.3f} | {K_lin:7.3f}")
+        print(f"{y:4d} | {C_prev:11.1f} | {C_curr:10.1f} | {E_y/1000:7.1f} | {K_exp:7.3f} | {K_lin:7.3f} | {K_flat:7.3f}")
 
     if K_exp_list:
         avg_exp = sum(K_exp_list)/len(K_exp_list)
-        med_exp = sorted(K_exp_list)[len(K_exp_list)//2]
+        med_exp = median(K_exp_list)
         print("\nSuggested K (exponential capacity):")
         print(f"  Mean K_exp  : {avg_exp:.3f}")
         print(f"  Median K_exp: {med_exp:.3f}")
 
     if K_lin_list:
         avg_lin = sum(K_lin_list)/len(K_lin_list)
-        med_lin = sorted(K_lin_list)[len(K_lin_list)//2]
+        med_lin = median(K_lin_list)
         print("\nSuggested K (linear capacity):")
         print(f"  Mean K_lin  : {avg_lin:.3f}")
         print(f"  Median K_lin: {med_lin:.3f}")
@@ -0,0 +1,143 @@
+"""
+Request plumbing shared by the scripts querying Opendatasoft explore v2.1
+catalogs (ODRE, Enedis).
+"""
+
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from functools import lru_cache
+from typing import Any
+from urllib.parse import urlencode, quote
+
+# -----------------------------
+# CONSTANTS
+# -----------------------------
+
+ODRE_BASE = "https://odre.opendatasoft.com/api/explore/v2.1/catalog/datasets"
+ENEDIS_BASE = "https://data.enedis.fr/api/explore/v2.1/catalog/datasets"
+
+HTTP_TIMEOUT = 30  # seconds
+
+# Largest page the explore v2.1 API returns
+PAGE_SIZE = 100
+
+# The explore v2.1 API rejects queries with offset + limit beyond this
+MAX_WINDOW = 10000
+
+
+# -----------------------------
+# Session
+# -----------------------------
+
+def make_session() -> requests.Session:
+    """
+    HTTP session shared by all requests, so connections (and TLS handshakes)
+    are reused across calls and threads. Transient server errors are retried.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 502, 503, 504]),
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+SESSION = make_session()
+
+
+# -----------------------------
+# Client
+# -----------------------------
+
+class Client:
+    """
+    Opendatasoft catalog rooted at `base`.
+    """
+
+    def __init__(self, base: str, session: requests.Session = SESSION) -> None:
+        self.base = base
+        self.session = session
+
+    def fetch(self, dataset: str, params: dict) -> list[dict[Any, Any]]:
+        """
+        Query the records of a dataset. Memoized: an identical query is only
+        encoded and sent once per process. The returned list is shared
+        between callers and must not be modified.
+        """
+        return self._fetch(dataset, tuple(sorted(params.items())))
+
+    @lru_cache(maxsize=None)
+    def _fetch(self, dataset: str, params: tuple[tuple[str, Any], ...]) -> list[dict[Any, Any]]:
+        """
+        Uncached query, handling proper URL-encoding (spaces as %20, not '+').
+        """
+        base = f"{self.base}/{dataset}/records"
+        if params:
+            query = urlencode(params, quote_via=quote)
+            url = f"{base}?{query}"
+        else:
+            url = base
+
+        r = self.session.get(url, timeout=HTTP_TIMEOUT)
+        r.raise_for_status()
+        data = orjson.loads(r.content)
+        return data.get("results", [])
+
+    def records(
+        self,
+        dataset: str,
+        where: str | None = None,
+        select: str | None = None,
+        group_by: str | None = None,
+        limit: int | None = None,
+        offset: int | None = None,
+    ) -> list[dict[Any, Any]]:
+        """
+        Query with the usual parameters; memoized like fetch().
+        """
+        params = {
+            key: value
+            for key, value in (
+                ("where", where),
+                ("select", select),
+                ("group_by", group_by),
+                ("limit", limit),
+                ("offset", offset),
+            )
+            if value is not None
+        }
+        return self.fetch(dataset, params)
+
+    def all_records(
+        self,
+        dataset: str,
+        where: str | None = None,
+        select: str | None = None,
+        group_by: str | None = None,
+    ) -> list[dict[Any, Any]]:
+        """
+        All matching records, fetched page by page so that none are
+        silently dropped by the server's page size limit. Raises if there
+        are more than the API can page through (MAX_WINDOW).
+        """
+        results = []
+        offset = 0
+        while True:
+            if offset + PAGE_SIZE > MAX_WINDOW:
+                raise RuntimeError(
+                    f"At least {MAX_WINDOW} records in {dataset} for where={where!r}; "
+                    "narrow the query or use the export API"
+                )
+            batch = self.records(dataset, where, select, group_by, PAGE_SIZE, offset)
+            results.extend(batch)
+            if len(batch) < PAGE_SIZE:
+                return results
+            offset += PAGE_SIZE
+
+
+odre = Client(ODRE_BASE)
+enedis = Client(ENEDIS_BASE)
@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
 
-import requests
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import Any
-from urllib.parse import urlencode, quote
+
+from ods_client import odre, enedis
 
 # -----------------------------
 # CONSTANTS
@@ -14,14 +15,11 @@ INSEE_ANTONY = "92002"
 IDF_REGION_CODE = "11"
 YEAR = 2023
 
-# Base URLs
-ODRE_BASE = "https://odre.opendatasoft.com/api/explore/v2.1/catalog/datasets"
-ENEDIS_BASE = "https://data.enedis.fr/api/explore/v2.1/catalog/datasets"
-
 # ODRE register (capacity snapshot)
 
 REGISTRE_DATASET = f"registre-national-installation-production-stockage-electricite-agrege"
 
+@lru_cache(maxsize=None)
 def registre_dataset(year: int | None = None) -> str:
     """
     Returns the data set for installed capacity at the end of the given year,
@@ -42,6 +40,12 @@ REGISTER_PROD_1Y_FIELD_OLD = "energieannuelleinjectee"        # Before 2020; kWh
 REGISTER_TENSION_FIELD = "tensionraccordement"
 REGISTER_NAME_FIELD = "nominstallation"
 
+# Photovoltaic solar only
+REGISTER_SOLAR_PV_WHERE = (
+    f"{REGISTER_GEN_CODE_FIELD}='SOLAI'"
+    f" AND {REGISTER_TECH_CODE_FIELD}='PHOTV'"
+)
+
 # eco2mix regional production
 # There is also a "real-time" version, eco2mix-national-tr, which we want
 # to use, which is why we need a good calibration for eco2mix data.
@@ -58,54 +62,38 @@ ENEDIS_YEAR_FIELD = "annee"
 ENEDIS_REGION_FIELD = "code_region"
 ENEDIS_PV_ENERGY_FIELD = "energie_produite_annuelle_photovoltaique_enedis_mwh"
 
+# Number of concurrent API requests
+MAX_WORKERS = 8
+
 
 # -----------------------------
-# Helpers
+# Exploration queries
 # -----------------------------
 
-def fetch_ods(base_url: str, dataset: str, params: dict) -> list[dict[Any, Any]]:
+def get_odre_all(location_field: str, location_value: str, year: int | None, label: str, limit: int | None = 20, where: str | None = None) -> list[dict[Any, Any]]:
     """
-    Generic helper to call an Opendatasoft dataset (ODRE or Enedis),
-    handling proper URL-encoding (spaces as %20, not '+').
+    Register rows matching a location, optionally narrowed by an extra
+    where clause. With limit=None, all rows are returned.
     """
-    base = f"{base_url}/{dataset}/records"
-    if params:
-        query = urlencode(params, quote_via=quote)
-        url = f"{base}?{query}"
-    else:
-        url = base
-
-    r = requests.get(url)
-    r.raise_for_status()
-    data = r.json()
-    return data.get("results", [])
-
-
-def fetch_odre(dataset: str, params: dict) -> list[dict[Any, Any]]:
-    return fetch_ods(ODRE_BASE, dataset, params)
+    where_clause = f"{location_field}='{location_value}'"
+    if where:
+        where_clause += f" AND {where}"
 
+    if limit is None:
+        return odre.all_records(registre_dataset(year), where=where_clause)
 
-def fetch_enedis(dataset: str, params: dict) -> list[dict[Any, Any]]:
-    return fetch_ods(ENEDIS_BASE, dataset, params)
-
-
-# -----------------------------
-# Exploration queries
-# -----------------------------
-
-def get_odre_all(location_field: str, location_value: str, year: int | None, label: str, limit: int = 20) -> list[dict[Any, Any]]:
     params = {
-        "where": f"{location_field}='{location_value}'",
+        "where": where_clause,
         "limit": limit,
     }
 
-    return fetch_odre(registre_dataset(year), params)
+    return odre.records(registre_dataset(year), **params)
 
-def get_antony_odre_all(year: int | None = None, limit: int = 20) -> list[dict[Any, Any]]:
-    return get_odre_all(REGISTER_COMMUNE_FIELD, INSEE_ANTONY, year, "Antony", limit)
+def get_antony_odre_all(year: int | None = None, limit: int | None = 20, where: str | None = None) -> list[dict[Any, Any]]:
+    return get_odre_all(REGISTER_COMMUNE_FIELD, INSEE_ANTONY, year, "Antony", limit, where)
 
-def get_idf_odre_all(year: int | None = None, limit: int = 20) -> list[dict[Any, Any]]:
-    return get_odre_all(REGISTER_REGION_FIELD, IDF_REGION_CODE, year, "IdF", limit)
+def get_idf_odre_all(year: int | None = None, limit: int | None = 20, where: str | None = None) -> list[dict[Any, Any]]:
+    return get_odre_all(REGISTER_REGION_FIELD, IDF_REGION_CODE, year, "IdF", limit, where)
 
 # -----------------------------
 # Capacity queries
@@ -124,20 +112,20 @@ def get_pv_capacity_total_kw(location_field: str, location_value: str, year: int
         "where": where_clause,
         "select": f"sum({REGISTER_POWER_FIELD}) as p_inst_kw",
         "group_by": location_field,
-        "limit": 2,
+        "limit": 1,
     }
 
-    df = pd.json_normalize(fetch_odre(registre_dataset(year), params))
+    rows = odre.records(registre_dataset(year), **params)
 
-    if len(df) != 1:
-        raise RuntimeError(f"[{label} total] Expected 1 row, got {len(df)}. Params: {params}")
+    if len(rows) != 1:
+        raise RuntimeError(f"[{label} total] Expected 1 row, got {len(rows)}. Params: {params}")
 
-    if "p_inst_kw" not in df.columns:
+    if "p_inst_kw" not in rows[0]:
         raise RuntimeError(
-            f"[{label} total] 'p_inst_kw' not found. Columns: {df.columns.tolist()}"
+            f"[{label} total] 'p_inst_kw' not found. Columns: {list(rows[0])}"
         )
 
-    return float(df["p_inst_kw"].iloc[0])
+    return float(rows[0]["p_inst_kw"] or 0.0)
 
 
 def get_pv_capacity_antony_total_kw(year: int | None) -> float:
@@ -172,20 +160,20 @@ def get_eco2mix_idf_produced_mwh(year: int) -> float:
         "where": where_clause,
         "select": f"sum({ECO2MIX_SOLAR_FIELD}) as sum_solar_mw",
         "group_by": ECO2MIX_REGION_FIELD,
-        "limit": 2,
+        "limit": 1,
     }
 
-    df = pd.json_normalize(fetch_odre(ECO2MIX_DATASET, params))
+    rows = odre.records(ECO2MIX_DATASET, **params)
 
-    if len(df) != 1:
-        raise RuntimeError(f"[eco2mix] Expected 1 row, got {len(df)}. Params: {params}")
+    if len(rows) != 1:
+        raise RuntimeError(f"[eco2mix] Expected 1 row, got {len(rows)}. Params: {params}")
 
-    if "sum_solar_mw" not in df.columns:
+    if "sum_solar_mw" not in rows[0]:
         raise RuntimeError(
-            f"[eco2mix] 'sum_solar_mw' not found. Columns: {df.columns.tolist()}"
+            f"[eco2mix] 'sum_solar_mw' not found. Columns: {list(rows[0])}"
         )
 
-    sum_mw = float(df["sum_solar_mw"].iloc[0] or 0.0)
+    sum_mw = float(rows[0]["sum_solar_mw"] or 0.0)
     return sum_mw * 0.5  # half-hourly → MWh
 
 
@@ -199,22 +187,22 @@ def get_enedis_produced_mwh(location_field: str, location_value: str, year: int,
         "where": where_clause,
         "select": f"sum({ENEDIS_PV_ENERGY_FIELD}) as energy_mwh",
         "group_by": location_field,
-        "limit": 2,
+        "limit": 1,
     }
 
-    df = pd.json_normalize(fetch_enedis(ENEDIS_PROD_DATASET, params))
+    rows = enedis.records(ENEDIS_PROD_DATASET, **params)
 
-    if len(df) != 1:
+    if len(rows) != 1:
         raise RuntimeError(
-            f"[Enedis label] Expected 1 row, got {len(df)}. Params: {params}"
+            f"[Enedis {label}] Expected 1 row, got {len(rows)}. Params: {params}"
         )
 
-    if "energy_mwh" not in df.columns:
+    if "energy_mwh" not in rows[0]:
         raise RuntimeError(
-            f"[Enedis label] 'energy_mwh' not found. Columns: {df.columns.tolist()}"
+            f"[Enedis {label}] 'energy_mwh' not found. Columns: {list(rows[0])}"
         )
 
-    return float(df["energy_mwh"].iloc[0])
+    return float(rows[0]["energy_mwh"] or 0.0)
 
 
 def get_enedis_antony_produced_mwh(year: int) -> float:
@@ -276,33 +264,25 @@ def dump_antony() -> None:
 
     codes_iris = set()
     all_fields = set()
-    year_data = {}
-    for year in range(YEAR_FIRST, YEAR_LAST + 1):
-        data = get_antony_odre_all(year)
-        year_data[year] = data
-        for row in data:
-            # The following should be added to the WHERE clause.  Done this way
-            # for the moment to detect if there's any information about other
-            # energy sources.
-            code_filiere = row.get('codefiliere')
-            if code_filiere != 'SOLAI':
-                print(f"Skipping code filiare {code_filiere}")
-                continue
-
-            code_technologie = row.get('codetechnologie')
-            if code_technologie != 'PHOTV':
-                print(f"Skipping code technologie {code_technologie}")
-                continue
-
-            for key, value in row.items():
-                if value:
-                    all_fields.add(key)
-
-            # If a site is disconnected, would the capacity be set to zero?
-            assert row.get('datederaccordement') is None
-
-            code_iris = row.get('codeiris')
-            codes_iris.add(code_iris)
+    years = range(YEAR_FIRST, YEAR_LAST + 1)
+    with ThreadPoolExecutor(MAX_WORKERS) as ex:
+        data = ex.map(lambda year: get_antony_odre_all(year, limit=None, where=REGISTER_SOLAR_PV_WHERE), years)
+
+        # Rows of each year, indexed by IRIS code
+        year_data = {}
+        for year, rows in zip(years, data):
+            year_data[year] = {}
+            for row in rows:
+                for key, value in row.items():
+                    if value:
+                        all_fields.add(key)
+
+                # If a site is disconnected, would the capacity be set to zero?
+                assert row.get('datederaccordement') is None
+
+                code_iris = row.get('codeiris')
+                codes_iris.add(code_iris)
+                year_data[year].setdefault(code_iris, []).append(row)
 
     codes_iris = sorted(list(codes_iris), key=lambda x: (x is not None, x))
 
@@ -312,10 +292,9 @@ def dump_antony() -> None:
     print('code iris\tyear\t' + '\t'.join(fields))
     for code_iris in codes_iris:
         print(code_iris or "?????????")
-        for year in range(YEAR_FIRST, YEAR_LAST + 1):
-            for row in year_data[year]:
-                if row.get('codeiris') == code_iris:
-                    print(f'\t\t{year}\t' + '\t'.join([str(row.get(f)) for f in fields]))
+        for year in years:
+            for row in year_data[year].get(code_iris, []):
+                print(f'\t\t{year}\t' + '\t'.join([str(row.get(f)) for f in fields]))
         print()
 
 # -----------------------------